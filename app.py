@@ -1,12 +1,18 @@
 from flask import Flask, render_template, request, jsonify
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from models import initialize_database, create_user, create_user_profile, update_user_profile, create_user_image, create_user_with_details, get_users, get_user_details, get_user_by_id, get_user_details_by_id, update_user_profile, delete_user_by_id, authenticate_user, authenticate_user_jwt
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+from models import initialize_database, create_user, create_user_profile, update_user_profile, create_user_image, get_user_image_id_by_url, create_user_with_details, get_users, get_user_details, get_user_by_id, get_user_details_by_id, get_user_version, update_user_profile, delete_user_by_id, VersionConflict, MAX_IMAGE_URLS, authenticate_user, authenticate_user_jwt
 from config import Config, DevelopmentConfig, ProductionConfig
 from flask_cors import CORS
 import os, json
+from datetime import datetime, timezone
 from extensions import db
 from werkzeug.utils import secure_filename
-from auth import admin_required
+from auth import admin_required, get_user_role_from_jwt
+import statements
+import click
+from sqlalchemy.exc import IntegrityError
+from storage import init_storage, get_storage, new_image_key, StorageError
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 jwt = JWTManager()
 
@@ -18,11 +24,10 @@ config_class = os.getenv('FLASK_CONFIG', 'DevelopmentConfig')
 app.config.from_object(f'config.{config_class}')
 
 
-# Ensure the upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
 db.init_app(app)
 jwt.init_app(app)
+# Local storage also ensures the upload folder exists
+init_storage(app)
 
 with app.app_context():
     initialize_database()
@@ -43,6 +48,36 @@ def register_user():
         # Handle errors and conflicts, such as a duplicate username
         return jsonify({"error": "User creation failed", "details": str(e)}), 400
 
+#CREATE AN USER WITH ROLE, PROFILE AND IMAGES IN ONE REQUEST
+@app.route('/users/full', methods=['POST'])
+def register_user_full():
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+    email = data.get('email')
+    # Anyone can register as 'standard'; any other role needs an admin JWT
+    role_name = data.get('role_name') or 'standard'
+    if role_name != 'standard':
+        verify_jwt_in_request(optional=True)
+        if get_user_role_from_jwt() != 'admin':
+            return jsonify({"msg": "Administration privileges required."}), 403
+    profile_data = data.get('profile')
+    image_urls = data.get('image_urls', [])
+    if not username or not password or not email:
+        return jsonify({"error": "username, password and email are required"}), 400
+    if not isinstance(image_urls, list):
+        return jsonify({"error": "image_urls must be a list"}), 400
+    if len(image_urls) > MAX_IMAGE_URLS:
+        return jsonify({"error": f"At most {MAX_IMAGE_URLS} image_urls are allowed"}), 400
+    if not all(isinstance(image_url, str) and image_url for image_url in image_urls):
+        return jsonify({"error": "Each image URL must be a non-empty string"}), 400
+    try:
+        created = create_user_with_details(username, password, email, profile_data, image_urls, role_name)
+        return jsonify({"message": "User created successfully", **created}), 201
+    except Exception as e:
+        # Handle errors and conflicts, such as a duplicate username or unknown role
+        return jsonify({"error": "User creation failed", "details": str(e)}), 400
+
 #CREATE AN USER PROFILE WITH USER ID
 @app.route('/user_profile/<int:user_id>', methods=['POST'])
 def create_user_profile_by_id(user_id):
@@ -66,49 +101,192 @@ def create_user_image_by_id():
     # empty file without a filename.
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Assuming you have a model to save details in the database
-        # You will also need to collect other form data (e.g., username, email)
-        # user_details = {
-        #     'username': request.form.get('username'),
-        #     'email': request.form.get('email'),
-        #     'image_path': filepath
-        # }
-        image_url = filepath
-        user_id = request.form.get('user_id')
-  
+    # Check the sanitised name, since that is what the storage key is built from
+    filename = secure_filename(file.filename)
+    if not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    user_id = parse_user_id(request.form.get('user_id'))
+    if user_id is None:
+        return jsonify({"error": "user_id must be a positive integer"}), 400
+    key = new_image_key(user_id, filename)
+
     try:
+        storage = get_storage()
+        storage.save(key, file.stream)
         # Call your model function to create the image with user_id
-        image_id = create_user_image(user_id, image_url)
+        image_id = create_user_image(user_id, filename, storage.url(key))
         return jsonify({"message": "User Image created successfully", "image_id": image_id}), 201
     except Exception as e:
         # In a real application, you might want to log this error and return a more generic error message
         return jsonify({"error": "Failed to create image", "details": str(e)}), 400
 
+def parse_user_id(value):
+    # user_id ends up in the storage key, so only accept a plain positive integer
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value > 0 else None
+    if isinstance(value, str) and value.isdigit() and value.isascii():
+        user_id = int(value)
+        return user_id if user_id > 0 else None
+    return None
+
+def upload_serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='image-upload')
+
+#REQUEST A SIGNED URL TO UPLOAD AN USER IMAGE DIRECTLY TO STORAGE
+@app.route('/user_image/upload_url', methods=['POST'])
+def create_user_image_upload_url():
+    data = request.get_json()
+    user_id = parse_user_id(data.get('user_id'))
+    filename = secure_filename(data.get('filename') or '')
+    if user_id is None:
+        return jsonify({"error": "user_id must be a positive integer"}), 400
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+
+    key = new_image_key(user_id, filename)
+    expires_in = app.config['UPLOAD_URL_EXPIRES']
+    try:
+        # The content type is fixed by the storage backend from the key's extension
+        upload = get_storage().create_upload(key, expires_in)
+    except Exception as e:
+        return jsonify({"error": "Failed to create upload URL", "details": str(e)}), 400
+    # The confirm token ties the key to this user, so confirm cannot claim other objects
+    confirm_token = upload_serializer().dumps({'user_id': user_id, 'key': key, 'filename': filename})
+    return jsonify({**upload, "key": key, "expires_in": expires_in, "confirm_token": confirm_token}), 201
+
+#CONFIRM A DIRECT UPLOAD AND RECORD THE USER IMAGE
+@app.route('/user_image/confirm', methods=['POST'])
+def confirm_user_image_upload():
+    data = request.get_json()
+    try:
+        upload = upload_serializer().loads(data.get('confirm_token') or '', max_age=app.config['UPLOAD_CONFIRM_EXPIRES'])
+    except SignatureExpired:
+        return jsonify({"error": "Upload confirmation has expired"}), 400
+    except BadSignature:
+        return jsonify({"error": "Invalid upload confirmation"}), 400
+
+    storage = get_storage()
+    image_url = storage.url(upload['key'])
+    try:
+        # Confirming the same upload twice returns the image recorded the first time
+        image_id = get_user_image_id_by_url(upload['user_id'], image_url)
+        if image_id:
+            return jsonify({"message": "User Image already created", "image_id": image_id}), 200
+
+        size = storage.size(upload['key'])
+        if size is None:
+            return jsonify({"error": "Upload not found"}), 404
+        if size > app.config['MAX_CONTENT_LENGTH']:
+            storage.delete(upload['key'])
+            return jsonify({"error": "Upload exceeds the maximum allowed size"}), 413
+
+        try:
+            image_id = create_user_image(upload['user_id'], upload['filename'], image_url)
+        except IntegrityError:
+            # A concurrent confirm of the same token inserted it first (images.image_url is unique)
+            image_id = get_user_image_id_by_url(upload['user_id'], image_url)
+            if not image_id:
+                raise
+            return jsonify({"message": "User Image already created", "image_id": image_id}), 200
+        return jsonify({"message": "User Image created successfully", "image_id": image_id}), 201
+    except Exception as e:
+        return jsonify({"error": "Failed to create image", "details": str(e)}), 400
+
+#TARGET OF SIGNED UPLOAD URLS WHEN STORAGE_BACKEND IS 'local'
+@app.route('/uploads/<token>', methods=['POST'])
+def local_upload(token):
+    storage = get_storage()
+    if not hasattr(storage, 'load_upload_token'):
+        return jsonify({"error": "Not found"}), 404
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    try:
+        upload = storage.load_upload_token(token, app.config['UPLOAD_URL_EXPIRES'])
+        storage.save(upload['key'], request.files['file'].stream)
+    except StorageError as e:
+        return jsonify({"error": str(e)}), 400
+    return '', 204
+
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def user_etag(user_id, version):
+    # ETags are scoped to the URL, so /user and /user_details can share the users.version based value
+    return f"{user_id}.{version}"
+
+def as_utc(updated_at):
+    # updated_at is selected as UNIX_TIMESTAMP(), so it is independent of the MySQL time zone
+    return datetime.fromtimestamp(float(updated_at), timezone.utc) if updated_at is not None else None
+
+def not_modified(user_id):
+    """Return a 304 response if the client's cached copy is current, else None.
+
+    Only does the primary key version lookup, not the full query.
+    """
+    if not request.if_none_match and not request.if_modified_since:
+        return None
+    current = get_user_version(user_id)
+    if not current:
+        return None
+    etag = user_etag(user_id, current['version'])
+    last_modified = as_utc(current['updated_at'])
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = last_modified is not None and last_modified <= request.if_modified_since
+    if not fresh:
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+def versioned_response(user_id, body):
+    # The version columns are response metadata, not part of the body
+    version = body.pop('version')
+    updated_at = body.pop('updated_at')
+    response = jsonify(body)
+    response.set_etag(user_etag(user_id, version))
+    response.last_modified = as_utc(updated_at)
+    return response
+
+def expected_version_from_if_match(user_id):
+    """Parse If-Match into the version the client expects, or None if not conditional."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = f"{user_id}."
+    for tag in request.if_match:
+        if tag.startswith(prefix) and tag[len(prefix):].isdigit():
+            return int(tag[len(prefix):])
+    # Not one of our ETags, so it can never match
+    return -1
+
 #GET USER WITH USER ID    
 @app.route('/user/<int:user_id>', methods=['GET'])
 def user_by_id(user_id):
+    cached = not_modified(user_id)
+    if cached:
+        return cached
     user = get_user_by_id(user_id)
     if user:
-        return jsonify(user)
+        return versioned_response(user_id, user)
     else:
         return jsonify({"error": "User not found"}), 404
  
 #GET USER DETAILS WITH USER ID
 @app.route('/user_details/<int:user_id>', methods=['GET'])
 def user_details_by_id(user_id):
+    cached = not_modified(user_id)
+    if cached:
+        return cached
     user = get_user_details_by_id(user_id)
     if user:
-        return jsonify(user), 200
+        return versioned_response(user_id, user), 200
     else:
         return jsonify({"error": "User not found"}), 404
 
@@ -127,9 +305,13 @@ def user_details_by_id(user_id):
 def update_user_details(user_id):
     data = request.get_json()
     profile_data = data.get('profile')  
-    user = update_user_profile(user_id, profile_data['first_name'], profile_data['last_name'], profile_data['contact_no'], profile_data['dob'], profile_data['bio'], profile_data['country'])
+    expected_version = expected_version_from_if_match(user_id)
+    try:
+        user = update_user_profile(user_id, profile_data['first_name'], profile_data['last_name'], profile_data['contact_no'], profile_data['dob'], profile_data['bio'], profile_data['country'], expected_version)
+    except VersionConflict as e:
+        return jsonify({"error": "User has been modified", "details": str(e)}), 412
     if user:
-        return jsonify(user)
+        return versioned_response(user_id, user)
     else:
         return jsonify({"error": "User not found"}), 404
 
@@ -188,5 +370,40 @@ def protected_admin():
     current_user = get_jwt_identity()
     return jsonify(logged_in_as=current_user), 200
 
+#PER-STATEMENT PROFILING (calls, latency, rows) FOR THIS WORKER
+@app.route('/admin/statement_stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def statement_stats():
+    return jsonify(statements.get_stats()), 200
+
+
+#RUN EXPLAIN ON EVERY REGISTERED STATEMENT: flask explain-statements
+@app.cli.command('explain-statements')
+@click.option('--fail-on-scan', is_flag=True, help='Exit with status 1 if any statement fails to EXPLAIN or does an unexpected full table scan.')
+def explain_statements(fail_on_scan):
+    """EXPLAIN every registered statement against the configured (seeded) database."""
+    with db.engine.connect() as connection:
+        report = statements.explain_all(connection)
+
+    flagged = 0
+    errors = 0
+    for entry in report:
+        if entry['error']:
+            errors += 1
+            click.echo(f"ERROR {entry['name']}: {entry['error']}")
+        elif entry['full_scans'] and not entry['allow_full_scan']:
+            flagged += 1
+            click.echo(f"SCAN  {entry['name']}: full table scan on {', '.join(str(t) for t in entry['full_scans'])}")
+        elif entry['full_scans']:
+            click.echo(f"OK    {entry['name']} (expected full table scan)")
+        else:
+            click.echo(f"OK    {entry['name']}")
+
+    click.echo(f"{len(report)} statements checked, {flagged} with unexpected full table scans, {errors} failed")
+    if fail_on_scan and (flagged or errors):
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="127.0.0.1")
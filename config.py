@@ -14,6 +14,15 @@ class Config:
     UPLOAD_FOLDER = 'static/images/'  # Directory where images will be stored
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max-limit for uploads
 
+    # Image storage: 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible service, e.g. MinIO locally)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'local'
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://minio:9000, None for AWS
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL')  # base URL used in images.image_url
+    UPLOAD_URL_EXPIRES = 300  # seconds a signed upload URL is valid
+    UPLOAD_CONFIRM_EXPIRES = 3600  # seconds a client has to confirm an upload
+
     
 
 class DevelopmentConfig(Config):
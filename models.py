@@ -1,6 +1,9 @@
 from extensions import db, bcrypt
-from sqlalchemy import text, exc
+from sqlalchemy import text, exc, event
 from flask_jwt_extended import create_access_token
+import statements
+from itertools import combinations
+from statements import register
 
 def create_user_tables():
     users_table_sql = text("""
@@ -8,7 +11,9 @@ def create_user_tables():
             id INT AUTO_INCREMENT PRIMARY KEY,
             username VARCHAR(80) UNIQUE NOT NULL,
             password VARCHAR(64) NOT NULL, 
-            email VARCHAR(120) UNIQUE NOT NULL
+            email VARCHAR(120) UNIQUE NOT NULL,
+            version INT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
         )ENGINE=InnoDB;
     """)
 
@@ -31,7 +36,8 @@ def create_user_tables():
             id INT AUTO_INCREMENT PRIMARY KEY,
             image_name VARCHAR(100) NOT NULL,
             image_url VARCHAR(255) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE INDEX uq_images_image_url (image_url)
         )ENGINE=InnoDB; 
     """)
 
@@ -80,9 +86,300 @@ def create_user_tables():
         # for role_name in roles:
         #     connection.execute(insert_role_sql, {'name': role_name})
 
+# MySQL errors meaning another worker already applied the same schema change
+ER_DUP_FIELDNAME = 1060
+ER_DUP_KEYNAME = 1061
+ER_CANT_DROP_FIELD_OR_KEY = 1091
+
+def apply_schema_change(sql, already_applied):
+    """Run one DDL statement, treating the given MySQL error codes as already applied.
+
+    Every worker runs these checks at startup, so two can race between the
+    information_schema lookup and the DDL; the loser must not fail to start.
+    """
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text(sql))
+    except exc.DBAPIError as e:
+        if e.orig is not None and e.orig.args and e.orig.args[0] in already_applied:
+            return
+        raise
+
+def add_user_version_columns():
+    """Add users.version and users.updated_at to databases created before they existed."""
+    existing_sql = text("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'
+            AND COLUMN_NAME IN ('version', 'updated_at');
+    """)
+    columns = {
+        'version': "ALTER TABLE users ADD COLUMN version INT NOT NULL DEFAULT 1;",
+        'updated_at': "ALTER TABLE users ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;",
+    }
+
+    with db.engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(existing_sql)}
+    for column, alter_sql in columns.items():
+        if column not in existing:
+            apply_schema_change(alter_sql, (ER_DUP_FIELDNAME,))
+
+def add_image_url_index():
+    """Add the unique images.image_url index on databases created before it existed."""
+    existing_sql = text("""
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'images'
+            AND INDEX_NAME IN ('idx_images_image_url', 'uq_images_image_url');
+    """)
+
+    with db.engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(existing_sql)}
+    if 'uq_images_image_url' in existing:
+        return
+
+    try:
+        apply_schema_change("CREATE UNIQUE INDEX uq_images_image_url ON images (image_url);", (ER_DUP_KEYNAME,))
+    except exc.IntegrityError as e:
+        # Older rows share an image_url; keep serving and leave the non-unique lookup index
+        print('images.image_url has duplicates, unique index not created:', e)
+        if 'idx_images_image_url' not in existing:
+            apply_schema_change("CREATE INDEX idx_images_image_url ON images (image_url);", (ER_DUP_KEYNAME,))
+        return
+
+    # Superseded by the unique index (created by an earlier version of this function)
+    if 'idx_images_image_url' in existing:
+        apply_schema_change("DROP INDEX idx_images_image_url ON images;", (ER_CANT_DROP_FIELD_OR_KEY,))
+
+def read_auto_increment_increment(dbapi_connection, connection_record):
+    """Cache @@auto_increment_increment on each new pooled connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT @@auto_increment_increment')
+        connection_record.info['auto_increment_increment'] = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
 def initialize_database():
     """Create user tables if they don't exist before the first request."""
+    # Registered before the first connection is opened so every pooled connection has it
+    event.listen(db.engine, 'connect', read_auto_increment_increment)
     create_user_tables()
+    add_user_version_columns()
+    add_image_url_index()
+
+
+### STATEMENTS ###
+# Every query is defined once here and executed through statements.execute(),
+# which reuses the compiled statement and records calls, latency and rows.
+# The sample params are only used by `flask explain-statements`.
+INSERT_USER = register('users.insert', """
+    INSERT INTO users (username, password, email)
+    VALUES (:username, :password, :email);
+    """, {'username': 'explain', 'password': 'x', 'email': 'explain@example.com'})
+
+GET_ROLE_ID_BY_NAME = register('roles.id_by_name', """
+    SELECT id FROM roles WHERE roles.name = :role_name;
+    """, {'role_name': 'standard'})
+
+INSERT_USER_ROLE = register('user_roles.insert', """
+    INSERT INTO user_roles (user_id, role_id) VALUES (:user_id, :role_id);
+    """, {'user_id': 1, 'role_id': 1})
+
+INSERT_IMAGE = register('images.insert', """
+    INSERT INTO images (image_name, image_url) VALUES (:image_name, :image_url);
+    """, {'image_name': 'explain.png', 'image_url': 'static/images/explain.png'})
+
+# Lets a replayed upload confirmation find the image it already recorded
+GET_USER_IMAGE_BY_URL = register('images.by_user_and_url', """
+    SELECT images.id FROM images
+    JOIN user_image ON user_image.image_id = images.id
+    WHERE images.image_url = :image_url AND user_image.user_id = :user_id;
+    """, {'image_url': 'static/images/explain.png', 'user_id': 1})
+
+# Every change to a user's representation bumps users.version (updated_at follows automatically)
+BUMP_USER_VERSION = register('users.bump_version', """
+    UPDATE users SET version = version + 1 WHERE id = :user_id;
+    """, {'user_id': 1})
+
+# Cheap primary key lookup used to answer conditional requests.
+# updated_at is read as epoch seconds so it does not depend on the session time zone.
+GET_USER_VERSION = register('users.version', """
+    SELECT version, UNIX_TIMESTAMP(updated_at) AS updated_at FROM users WHERE id = :user_id;
+    """, {'user_id': 1})
+
+INSERT_USER_IMAGE = register('user_image.insert', """
+    INSERT INTO user_image (user_id, image_id) VALUES (:user_id, :image_id);
+    """, {'user_id': 1, 'image_id': 1})
+
+INSERT_USER_PROFILE = register('user_profiles.insert', """
+    INSERT INTO user_profiles (user_id, first_name, last_name, contact_no, dob, bio, country)
+    VALUES (:user_id, :first_name, :last_name, :contact_no, :dob, :bio, :country);
+    """, {'user_id': 1, 'first_name': 'a', 'last_name': 'b', 'contact_no': '1',
+          'dob': '2000-01-01', 'bio': '', 'country': 'SG'})
+
+GET_USER_BY_ID = register('users.by_id', """
+    SELECT id, username, email, version, UNIX_TIMESTAMP(updated_at) AS updated_at FROM users WHERE id = :user_id;
+    """, {'user_id': 1})
+
+GET_USER_DETAILS_BY_ID = register('users.details_by_id', """
+    SELECT 
+        users.id as user_id, 
+        users.username, 
+        users.email, 
+        users.status,
+        users.version,
+        UNIX_TIMESTAMP(users.updated_at) as updated_at,
+        user_profiles.first_name, 
+        user_profiles.last_name, 
+        user_profiles.contact_no, 
+        user_profiles.dob, 
+        user_profiles.bio, 
+        user_profiles.country,
+        roles.name as role_name,
+        GROUP_CONCAT(images.image_name) as image_names,
+        GROUP_CONCAT(images.image_url) as image_urls
+    FROM 
+        users
+    LEFT JOIN 
+        user_profiles ON users.id = user_profiles.user_id
+    LEFT JOIN 
+        user_image ON users.id = user_image.user_id 
+    LEFT JOIN
+        images ON user_image.image_id = images.id
+    LEFT JOIN 
+        user_roles ON users.id = user_roles.user_id 
+    LEFT JOIN
+        roles ON user_roles.role_id = roles.id
+    WHERE users.id = :user_id
+    GROUP BY 
+        users.id, 
+        user_profiles.id,
+        roles.id;
+    """, {'user_id': 1})
+
+UPDATE_USER_PROFILE = register('user_profiles.update', """
+    UPDATE user_profiles JOIN users ON users.id = user_profiles.user_id
+    SET user_profiles.first_name = :first_name, user_profiles.last_name = :last_name, user_profiles.contact_no = :contact_no,
+        user_profiles.dob = :dob, user_profiles.bio = :bio, user_profiles.country = :country,
+        users.version = users.version + 1
+    WHERE users.id = :user_id;
+    """, {'user_id': 1, 'first_name': 'a', 'last_name': 'b', 'contact_no': '1',
+          'dob': '2000-01-01', 'bio': '', 'country': 'SG'})
+
+# Same update, applied only if the client's version is still current (If-Match)
+UPDATE_USER_PROFILE_IF_VERSION = register('user_profiles.update_if_version', """
+    UPDATE user_profiles JOIN users ON users.id = user_profiles.user_id
+    SET user_profiles.first_name = :first_name, user_profiles.last_name = :last_name, user_profiles.contact_no = :contact_no,
+        user_profiles.dob = :dob, user_profiles.bio = :bio, user_profiles.country = :country,
+        users.version = users.version + 1
+    WHERE users.id = :user_id AND users.version = :expected_version;
+    """, {'user_id': 1, 'expected_version': 1, 'first_name': 'a', 'last_name': 'b', 'contact_no': '1',
+          'dob': '2000-01-01', 'bio': '', 'country': 'SG'})
+
+INSERT_ROLE = register('roles.insert', """
+    INSERT INTO user_profiles (role_name, description) VALUES (:role_name, :description);
+    """, {'role_name': 'explain', 'description': ''})
+
+GET_ROLE_BY_ID = register('roles.by_id', """
+    SELECT id, role_name, description FROM roles WHERE id = :role_id;
+    """, {'role_id': 1})
+
+UPDATE_ROLE = register('roles.update', """
+    UPDATE roles SET role_name = :role_name WHERE role_id = :id;
+    """, {'id': 1, 'role_name': 'explain'})
+
+DELETE_ROLE = register('roles.delete', """
+    DELETE FROM roles
+    WHERE roles.role_id = :id;
+    """, {'id': 1})
+
+GET_USERS = register('users.list', """
+    SELECT id, username, email FROM users;
+    """, allow_full_scan=True)
+
+GET_USER_DETAILS_PAGE = register('users.details_page', """
+    SELECT 
+        users.id as user_id, 
+        users.username, 
+        users.email, 
+        users.status,
+        user_profiles.first_name, 
+        user_profiles.last_name, 
+        user_profiles.contact_no, 
+        user_profiles.dob, 
+        user_profiles.bio, 
+        user_profiles.country,
+        GROUP_CONCAT(images.image_name) as image_names,
+        GROUP_CONCAT(images.image_url) as image_urls
+    FROM 
+        users
+    LEFT JOIN 
+        user_profiles ON users.id = user_profiles.user_id
+    LEFT JOIN 
+        user_image ON users.id = user_image.user_id 
+    LEFT JOIN
+        images ON user_image.image_id = images.id
+    GROUP BY 
+        users.id, 
+        user_profiles.id
+    ORDER BY 
+        users.id
+    LIMIT :per_page OFFSET :offset;
+    """, {'per_page': 10, 'offset': 0})
+
+SOFT_DELETE_USER = register('users.soft_delete', """
+    UPDATE users SET status = 2, version = version + 1
+    WHERE users.id = :user_id;
+    """, {'user_id': 1})
+
+DELETE_USER_PROFILE = register('user_profiles.delete_by_user', """
+    DELETE FROM user_profiles
+    WHERE user_profiles.user_id = :user_id;
+    """, {'user_id': 1})
+
+DELETE_USER = register('users.delete', """
+    DELETE FROM users                       
+    WHERE users.id = :user_id;
+    """, {'user_id': 1})
+
+AUTHENTICATE_USER = register('users.auth', """
+    SELECT id, password FROM users WHERE username = :username;
+    """, {'username': 'explain'})
+
+AUTHENTICATE_USER_JWT = register('users.auth_jwt', """
+    SELECT users.id as user_id, users.password as password, roles.name as role FROM 
+        users 
+    LEFT JOIN 
+        user_roles ON users.id = user_roles.user_id
+    LEFT JOIN 
+        roles ON user_roles.role_id = roles.id  
+        WHERE username = :username;
+    """, {'username': 'explain'})
+
+# Role link in one statement: resolves the role by name inside the INSERT
+INSERT_USER_ROLE_BY_NAME = register('user_roles.insert_by_name', """
+    INSERT INTO user_roles (user_id, role_id)
+    SELECT :user_id, roles.id FROM roles WHERE roles.name = :role_name;
+    """, {'user_id': 1, 'role_name': 'standard'})
+
+# Step between auto-increment ids; greater than 1 on multi-primary/Galera/Group Replication.
+# Read once per connection by read_auto_increment_increment(); this is only the fallback.
+GET_AUTO_INCREMENT_INCREMENT = register('session.auto_increment_increment', """
+    SELECT @@auto_increment_increment;
+    """)
+
+# Upper bound on images per create_user_with_details call; also bounds how many
+# images.insert_many[N] / user_image.insert_many[N] statements get registered
+MAX_IMAGE_URLS = 10
+
+PROFILE_COLUMNS = ('first_name', 'last_name', 'contact_no', 'dob', 'bio', 'country')
+
+# Columns update_user() may set; one statement is registered per column combination
+UPDATABLE_USER_COLUMNS = ('password', 'email', 'status')
+
+
+class VersionConflict(Exception):
+    """Raised when a conditional write's expected version is no longer current."""
+    pass
 
 
 ### CRUD USER ###
@@ -92,33 +389,17 @@ def create_user(username, password, email, role_name):
 
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')  # Hash the password
         print(hashed_password)
-        # Insert into users table
-        user_sql = text("""
-        INSERT INTO users (username, password, email) 
-        VALUES (:username, :password, :email);
-        """)
-        
-        # Execute the query
-        db.session.execute(user_sql, {'username': username, 'password': hashed_password, 'email': email})
-
-        # Fetch the ID of the last inserted row
-        user_id = db.session.execute(text('SELECT LAST_INSERT_ID();')).fetchone()[0]
+        # Insert into users table and take the id from the cursor (no extra round trip)
+        result = statements.execute(INSERT_USER, {'username': username, 'password': hashed_password, 'email': email})
+        user_id = result.lastrowid
 
-        get_role_id_sql = text("""
-            SELECT id FROM roles WHERE roles.name = :role_name;
-            """)
-        
-        result = db.session.execute(get_role_id_sql,{'role_name': role_name})
+        result = statements.execute(GET_ROLE_ID_BY_NAME, {'role_name': role_name})
         role = result.fetchone()
         role_id = role[0]
 
         print(role_id)
 
-        assign_role_sql = text("""
-            INSERT INTO user_roles (user_id, role_id) VALUES (:user_id, :role_id);
-            """)
-            
-        db.session.execute(assign_role_sql,{'user_id': user_id, 'role_id': role_id})
+        statements.execute(INSERT_USER_ROLE, {'user_id': user_id, 'role_id': role_id})
         
         db.session.commit()
         return user_id
@@ -132,21 +413,12 @@ def create_user_image(user_id, image_name, image_url):
     try:
 
         print(image_name, image_url)
-        # Insert into user_profiles table
-        image_sql = text("""
-        INSERT INTO images (image_name, image_url) VALUES (:image_name, :image_url)
-        """)
-
-        # Execute the query
-        db.session.execute(image_sql, {'image_name': image_name, 'image_url':image_url})
-
-        # Fetch the ID of the last inserted row
-        image_id = db.session.execute(text('SELECT LAST_INSERT_ID();')).fetchone()[0]
+        # Insert into images table
+        result = statements.execute(INSERT_IMAGE, {'image_name': image_name, 'image_url': image_url})
+        image_id = result.lastrowid
 
-        assign_image_sql = text("""
-            INSERT INTO user_image (user_id, image_id) VALUES (:user_id, :image_id);
-            """)
-        db.session.execute(assign_image_sql, {'user_id': user_id, 'image_id': image_id})
+        statements.execute(INSERT_USER_IMAGE, {'user_id': user_id, 'image_id': image_id})
+        statements.execute(BUMP_USER_VERSION, {'user_id': user_id})
 
         # user_image_id = db.session.execute(text('SELECT LAST_INSERT_ID();')).fetchone()[0]        
         db.session.commit()
@@ -156,16 +428,23 @@ def create_user_image(user_id, image_name, image_url):
         db.session.rollback()
         raise e
 
+def get_user_image_id_by_url(user_id, image_url):
+    try:
+        result = statements.execute(GET_USER_IMAGE_BY_URL, {'user_id': user_id, 'image_url': image_url})
+        return result.scalar()
+    except Exception as e:
+        # Rollback the transaction in case of error
+        db.session.rollback()
+        raise e
+
 #CREATE USER PROFILE
 def create_user_profile(user_id, profile_data):
     
     try:
         # Insert into user_profiles table
-        profile_sql = text("""
-        INSERT INTO user_profiles (user_id, first_name, last_name, contact_no, dob, bio, country) VALUES (:user_id, :first_name, :last_name, :contact_no, :dob, :bio, :country)
-        """)
-        db.session.execute(profile_sql, {**profile_data, 'user_id': user_id})
-        user_profile_id = db.session.execute(text('SELECT LAST_INSERT_ID();')).fetchone()[0]        
+        result = statements.execute(INSERT_USER_PROFILE, {**profile_data, 'user_id': user_id})
+        user_profile_id = result.lastrowid
+        statements.execute(BUMP_USER_VERSION, {'user_id': user_id})
         db.session.commit()
         return user_profile_id
     except Exception as e:
@@ -175,8 +454,7 @@ def create_user_profile(user_id, profile_data):
 
 def get_user_by_id(user_id):
     try:
-        sql = text("SELECT id, username, email FROM users WHERE id = :user_id;")
-        result = db.session.execute(sql, {'user_id': user_id})
+        result = statements.execute(GET_USER_BY_ID, {'user_id': user_id})
         user = result.fetchone()
 
         # No need to commit() as no changes are being written to the database
@@ -191,42 +469,19 @@ def get_user_by_id(user_id):
         db.session.rollback()
         raise e
 
+def get_user_version(user_id):
+    try:
+        result = statements.execute(GET_USER_VERSION, {'user_id': user_id})
+        row = result.fetchone()
+        return row._asdict() if row else None
+    except Exception as e:
+        # Rollback the transaction in case of error
+        db.session.rollback()
+        raise e
+
 def get_user_details_by_id(user_id):
     try:
-        sql = text("""
-        SELECT 
-            users.id as user_id, 
-            users.username, 
-            users.email, 
-            users.status,
-            user_profiles.first_name, 
-            user_profiles.last_name, 
-            user_profiles.contact_no, 
-            user_profiles.dob, 
-            user_profiles.bio, 
-            user_profiles.country,
-            roles.name as role_name,
-            GROUP_CONCAT(images.image_name) as image_names,
-            GROUP_CONCAT(images.image_url) as image_urls
-        FROM 
-            users
-        LEFT JOIN 
-            user_profiles ON users.id = user_profiles.user_id
-        LEFT JOIN 
-            user_image ON users.id = user_image.user_id 
-        LEFT JOIN
-            images ON user_image.image_id = images.id
-        LEFT JOIN 
-            user_roles ON users.id = user_roles.user_id 
-        LEFT JOIN
-            roles ON user_roles.role_id = roles.id
-        WHERE users.id = :user_id
-        GROUP BY 
-            users.id, 
-            user_profiles.id,
-            roles.id;
-        """)
-        result = db.session.execute(sql, {'user_id': user_id})
+        result = statements.execute(GET_USER_DETAILS_BY_ID, {'user_id': user_id})
         user_details = result.fetchone()
         return user_details._asdict() if user_details else None
     except Exception as e:
@@ -234,22 +489,24 @@ def get_user_details_by_id(user_id):
         db.session.rollback()
         raise e
 
+def update_user_statement(columns):
+    # One statement per column combination, e.g. users.update[email,status]
+    update_clauses = ', '.join([f"{key} = :{key}" for key in columns] + ['version = version + 1'])
+    return statements.get_or_register(
+        'users.update[' + ','.join(columns) + ']',
+        f"UPDATE users SET {update_clauses} WHERE id = :user_id;",
+        {**{key: '' for key in columns}, 'user_id': 1})
+
 def update_user(user_id, update_data):
     try:
-        update_clauses = []
-        params = {}
-        attr = ['password', 'email', 'status']
-        for key, value in update_data.items():
-            if key in attr:  # Ensure the key is an attribute of the User model
-                update_clauses.append(f"{key} = :{key}")
-                params[key] = value
-
-        if not update_clauses:
+        # Keep the column order fixed so each combination maps to one registered statement
+        columns = [key for key in UPDATABLE_USER_COLUMNS if key in update_data]
+        if not columns:
             return {'error': 'No valid fields provided for update'}
 
+        params = {key: update_data[key] for key in columns}
         params['user_id'] = user_id
-        sql = text(f"UPDATE users SET {', '.join(update_clauses)} WHERE id = :user_id")
-        result = db.session.execute(sql, params)
+        result = statements.execute(update_user_statement(columns), params)
         db.session.commit()
         print(result.rowcount)
         if result.rowcount > 0:
@@ -264,17 +521,28 @@ def update_user(user_id, update_data):
         db.session.rollback()
         raise e
 
-def update_user_profile(user_id, first_name, last_name, contact_no, dob, bio, country):
+def update_user_profile(user_id, first_name, last_name, contact_no, dob, bio, country, expected_version=None):
     try:
-        sql = text("UPDATE user_profiles SET first_name = :first_name, last_name = :last_name, contact_no = :contact_no, dob = :dob, bio = :bio, country = :country WHERE user_id = :user_id;")
-        result = db.session.execute(sql, {'user_id': user_id, 'first_name': first_name, 'last_name': last_name, 'contact_no': contact_no, 'dob': dob, 'bio': bio, 'country': country})
-        db.session.commit()
+        params = {'user_id': user_id, 'first_name': first_name, 'last_name': last_name, 'contact_no': contact_no, 'dob': dob, 'bio': bio, 'country': country}
+        if expected_version is None:
+            result = statements.execute(UPDATE_USER_PROFILE, params)
+        else:
+            result = statements.execute(UPDATE_USER_PROFILE_IF_VERSION, {**params, 'expected_version': expected_version})
+            if result.rowcount == 0:
+                # Either the user/profile is missing or someone else updated it first
+                current = statements.execute(GET_USER_VERSION, {'user_id': user_id}).fetchone()
+                if current and current.version != expected_version:
+                    raise VersionConflict(f"User {user_id} is at version {current.version}, not {expected_version}")
         print(result.rowcount)
         if result.rowcount > 0:
+            # Read the new version back before commit so the client gets its next validator
+            current = statements.execute(GET_USER_VERSION, {'user_id': user_id}).fetchone()
+            db.session.commit()
             # Convert the result into a dictionary if not None
             # user_details = result._asdict()
-            return {"user_id": user_id}
+            return {"user_id": user_id, "version": current.version, "updated_at": current.updated_at}
         else:
+            db.session.commit()
             return None
 
     except Exception as e:
@@ -282,16 +550,96 @@ def update_user_profile(user_id, first_name, last_name, contact_no, dob, bio, co
         db.session.rollback()
         raise e
 
-def create_user_with_details(username, password, email, profile_data, image_urls):
-    pass
+def insert_images_statement(count):
+    # One statement per batch size, e.g. images.insert_many[3]
+    values = ', '.join(f"(:image_name_{i}, :image_url_{i})" for i in range(count))
+    sample = {}
+    for i in range(count):
+        sample[f'image_name_{i}'] = 'explain.png'
+        sample[f'image_url_{i}'] = 'static/images/explain.png'
+    return statements.get_or_register(
+        f'images.insert_many[{count}]',
+        f"INSERT INTO images (image_name, image_url) VALUES {values};",
+        sample)
+
+def insert_user_images_statement(count):
+    # One statement per batch size, e.g. user_image.insert_many[3]
+    values = ', '.join(f"(:user_id, :image_id_{i})" for i in range(count))
+    sample = {'user_id': 1}
+    for i in range(count):
+        sample[f'image_id_{i}'] = i + 1
+    return statements.get_or_register(
+        f'user_image.insert_many[{count}]',
+        f"INSERT INTO user_image (user_id, image_id) VALUES {values};",
+        sample)
+
+#CREATE USER, ROLE, PROFILE AND IMAGES IN ONE TRANSACTION
+def create_user_with_details(username, password, email, profile_data, image_urls, role_name='standard'):
+    image_urls = image_urls or []
+    if len(image_urls) > MAX_IMAGE_URLS:
+        raise ValueError(f"At most {MAX_IMAGE_URLS} image URLs are allowed")
+    if not all(isinstance(image_url, str) and image_url for image_url in image_urls):
+        raise ValueError("Each image URL must be a non-empty string")
+
+    try:
+        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')  # Hash the password
+
+        result = statements.execute(INSERT_USER, {'username': username, 'password': hashed_password, 'email': email})
+        user_id = result.lastrowid
+
+        result = statements.execute(INSERT_USER_ROLE_BY_NAME, {'user_id': user_id, 'role_name': role_name})
+        if result.rowcount == 0:
+            raise ValueError(f"Role '{role_name}' does not exist")
+
+        profile_id = None
+        if profile_data:
+            params = {key: profile_data.get(key) for key in PROFILE_COLUMNS}
+            result = statements.execute(INSERT_USER_PROFILE, {**params, 'user_id': user_id})
+            profile_id = result.lastrowid
+
+        image_ids = []
+        if image_urls:
+            params = {}
+            for i, image_url in enumerate(image_urls):
+                params[f'image_name_{i}'] = image_url.rsplit('/', 1)[-1]
+                params[f'image_url_{i}'] = image_url
+            result = statements.execute(insert_images_statement(len(image_urls)), params)
+            # InnoDB gives the rows of a multi-row INSERT ... VALUES ids spaced by
+            # auto_increment_increment without gaps, and lastrowid is the first one
+            first_id = result.lastrowid
+            step = db.session.connection().info.get('auto_increment_increment')
+            if step is None:
+                step = statements.execute(GET_AUTO_INCREMENT_INCREMENT).scalar()
+            image_ids = [first_id + i * step for i in range(len(image_urls))]
+
+            # Link exactly the ids computed above, never a range that could hold other rows
+            params = {'user_id': user_id}
+            for i, image_id in enumerate(image_ids):
+                params[f'image_id_{i}'] = image_id
+            statements.execute(insert_user_images_statement(len(image_ids)), params)
+
+        db.session.commit()
+        return {'user_id': user_id, 'profile_id': profile_id, 'image_ids': image_ids}
+
+    except Exception as e:
+        # Rollback the transaction in case of error
+        db.session.rollback()
+        raise e
+
+# Register every generated variant up front so `flask explain-statements` covers them too
+for n in range(1, len(UPDATABLE_USER_COLUMNS) + 1):
+    for columns in combinations(UPDATABLE_USER_COLUMNS, n):
+        update_user_statement(list(columns))
+for n in range(1, MAX_IMAGE_URLS + 1):
+    insert_images_statement(n)
+    insert_user_images_statement(n)
 
 
 def create_role(role_name, description):
 
     try:
-        sql = text(""" INSERT INTO user_profiles (role_name, description) VALUES (:role_name, :description) """)
-        result = db.session.execute(sql, {'role_name': role_name, 'description': description})
-        role_id = db.session.execute(text('SELECT LAST_INSERT_ID();')).fetchone()[0]        
+        result = statements.execute(INSERT_ROLE, {'role_name': role_name, 'description': description})
+        role_id = result.lastrowid
         db.session.commit()
         return role_id
     
@@ -302,8 +650,7 @@ def create_role(role_name, description):
  
 def get_role_by_id(role_id):
     try:
-        sql = text("SELECT id, role_name, description FROM roles WHERE id = :role_id;")
-        result = db.session.execute(sql, {'role_id': role_id})
+        result = statements.execute(GET_ROLE_BY_ID, {'role_id': role_id})
         role = result.fetchone()
 
         # No need to commit() as no changes are being written to the database
@@ -320,8 +667,7 @@ def get_role_by_id(role_id):
  
 def update_role_by_id(role_id, role_name):
     try:
-        sql = text("UPDATE roles SET role_name = :role_name WHERE role_id = :id;")
-        result = db.session.execute(sql, {'id': role_id, 'role_name': role_name})
+        result = statements.execute(UPDATE_ROLE, {'id': role_id, 'role_name': role_name})
         db.session.commit()
 
         if result.rowcount > 0:
@@ -337,12 +683,7 @@ def update_role_by_id(role_id, role_name):
  
 def delete_role_by_id(role_id):
     try:
-        sql_delete_role = text("""
-        DELETE FROM roles
-        WHERE roles.role_id = :id;
-        """)
-
-        result = db.session.execute(sql_delete_role, {'id': role_id})
+        statements.execute(DELETE_ROLE, {'id': role_id})
 
         db.session.commit()
 
@@ -355,45 +696,15 @@ def delete_role_by_id(role_id):
 
 
 def get_users():
-    sql = 'SELECT id, username, email FROM users;'
-    result = db.session.execute(sql)
-    users = [dict(row) for row in result]
+    result = statements.execute(GET_USERS)
+    users = [dict(row) for row in result.mappings()]
     return users
 
 
 def get_user_details(per_page, offset):
     print(per_page, offset)
     try:
-        sql = text("""
-        SELECT 
-            users.id as user_id, 
-            users.username, 
-            users.email, 
-            users.status,
-            user_profiles.first_name, 
-            user_profiles.last_name, 
-            user_profiles.contact_no, 
-            user_profiles.dob, 
-            user_profiles.bio, 
-            user_profiles.country,
-            GROUP_CONCAT(images.image_name) as image_names,
-            GROUP_CONCAT(images.image_url) as image_urls
-        FROM 
-            users
-        LEFT JOIN 
-            user_profiles ON users.id = user_profiles.user_id
-        LEFT JOIN 
-            user_image ON users.id = user_image.user_id 
-        LEFT JOIN
-            images ON user_image.image_id = images.id
-        GROUP BY 
-            users.id, 
-            user_profiles.id
-        ORDER BY 
-            users.id
-        LIMIT :per_page OFFSET :offset;
-        """)
-        result = db.session.execute(sql, {'per_page':per_page, 'offset': offset })
+        result = statements.execute(GET_USER_DETAILS_PAGE, {'per_page': per_page, 'offset': offset})
         # user_details = result.fetchone()
         # return user_details._asdict() if user_details else None
         results = result.fetchall()
@@ -409,14 +720,8 @@ def get_user_details(per_page, offset):
 
 def delete_user_by_id(user_id):
     try:
-        sql_delete_user = text("""
-        UPDATE users SET status = 2                       
-        WHERE users.id = :user_id;
-        """)
-        result1 = db.session.execute(sql_delete_profile, {'user_id': user_id})
-        result2 = db.session.execute(sql_delete_user, {'user_id': user_id})
+        statements.execute(SOFT_DELETE_USER, {'user_id': user_id})
         db.session.commit()
-        # delete_1 = result1.fetchone()
         return {'user_id':user_id}
     except Exception as e:
         # Rollback the transaction in case of error
@@ -425,18 +730,9 @@ def delete_user_by_id(user_id):
 
 def hard_delete_user_by_id(user_id):
     try:
-        sql_delete_profile = text("""
-        DELETE FROM user_profiles
-        WHERE user_profiles.user_id = :user_id;
-        """)
-        sql_delete_user = text("""
-        DELETE FROM users                       
-        WHERE users.id = :user_id;
-        """)
-        result1 = db.session.execute(sql_delete_profile, {'user_id': user_id})
-        result2 = db.session.execute(sql_delete_user, {'user_id': user_id})
+        statements.execute(DELETE_USER_PROFILE, {'user_id': user_id})
+        statements.execute(DELETE_USER, {'user_id': user_id})
         db.session.commit()
-        # delete_1 = result1.fetchone()
         return {'user_id':user_id}
     except Exception as e:
         # Rollback the transaction in case of error
@@ -447,8 +743,7 @@ def hard_delete_user_by_id(user_id):
 def authenticate_user(username, password):
     # hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')  # Hash the password
 
-    sql = text('SELECT id, password FROM users WHERE username = :username;')
-    result = db.session.execute(sql, {'username': username})
+    result = statements.execute(AUTHENTICATE_USER, {'username': username})
     user = result.mappings().first()  # This gives you a dict-like object
 
     if user:
@@ -463,16 +758,7 @@ def authenticate_user(username, password):
 def authenticate_user_jwt(username, password):
     # hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')  # Hash the password
 
-    sql = text("""
-    SELECT users.id as user_id, users.password as password, roles.name as role FROM 
-        users 
-    LEFT JOIN 
-        user_roles ON users.id = user_roles.user_id
-    LEFT JOIN 
-        roles ON user_roles.role_id = roles.id  
-        WHERE username = :username;
-    """)
-    result = db.session.execute(sql, {'username': username})
+    result = statements.execute(AUTHENTICATE_USER_JWT, {'username': username})
     user = result.mappings().first()  # This gives you a dict-like object
     if user:
         print('role:'+ user['role'])
@@ -490,4 +776,4 @@ def authenticate_user_jwt(username, password):
             # Authentication failed
     else:
         return None  
-        # Authentication failed
\ No newline at end of file
+        # Authentication failed
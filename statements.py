@@ -0,0 +1,124 @@
+# statements.py
+import time
+import threading
+from sqlalchemy import text
+from extensions import db
+
+
+class Statement:
+    def __init__(self, name, sql, sample_params=None, allow_full_scan=False):
+        self.name = name
+        self.sql = sql
+        # Built once so SQLAlchemy can reuse the compiled form from its cache
+        self.clause = text(sql)
+        # Example parameters used when running EXPLAIN against a seeded database
+        self.sample_params = sample_params or {}
+        # Set for statements that scan a whole table by design (e.g. unfiltered lists)
+        self.allow_full_scan = allow_full_scan
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+
+    def record(self, elapsed, rowcount):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if rowcount is not None and rowcount > 0:
+            self.rows += rowcount
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'total_ms': round(self.total_time * 1000, 3),
+            'avg_ms': round(self.total_time * 1000 / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_time * 1000, 3),
+            'rows': self.rows,
+        }
+
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def register(name, sql, sample_params=None, allow_full_scan=False):
+    """Define a statement once. Registering the same name twice is an error."""
+    with _lock:
+        if name in _registry:
+            raise ValueError(f"Statement '{name}' is already registered")
+        statement = Statement(name, sql, sample_params, allow_full_scan)
+        _registry[name] = statement
+        return statement
+
+
+def get_or_register(name, sql, sample_params=None):
+    """Return the statement for name, registering it on first use (for generated SQL).
+
+    Generated statements are only seen by explain_all() if they are registered
+    at import time, so callers should pre-register every variant they can produce.
+    """
+    statement = _registry.get(name)
+    if statement is None:
+        with _lock:
+            statement = _registry.get(name)
+            if statement is None:
+                statement = Statement(name, sql, sample_params)
+                _registry[name] = statement
+    return statement
+
+
+def execute(statement, params=None, connection=None):
+    """Execute a registered statement on the session (or the given connection) and profile it."""
+    if isinstance(statement, str):
+        statement = _registry[statement]
+    target = connection if connection is not None else db.session
+    start = time.perf_counter()
+    result = target.execute(statement.clause, params or {})
+    elapsed = time.perf_counter() - start
+    with _lock:
+        statement.record(elapsed, result.rowcount)
+    return result
+
+
+def all_statements():
+    return list(_registry.values())
+
+
+def get_stats():
+    return [statement.stats() for statement in sorted(_registry.values(), key=lambda s: s.name)]
+
+
+def reset_stats():
+    with _lock:
+        for statement in _registry.values():
+            statement.calls = 0
+            statement.total_time = 0.0
+            statement.max_time = 0.0
+            statement.rows = 0
+
+
+def explain_all(connection):
+    """Run EXPLAIN on every registered statement and flag full table scans.
+
+    Returns a list of dicts, one per statement, with the plan rows, the
+    tables that MySQL reports with access type ALL, and whether such a
+    scan is expected for that statement.
+    """
+    report = []
+    for statement in sorted(_registry.values(), key=lambda s: s.name):
+        entry = {'name': statement.name, 'plan': [], 'full_scans': [], 'allow_full_scan': statement.allow_full_scan, 'error': None}
+        try:
+            result = connection.execute(text('EXPLAIN ' + statement.sql), statement.sample_params)
+            for row in result.mappings():
+                plan_row = dict(row)
+                entry['plan'].append(plan_row)
+                # MySQL reports the target of INSERT ... VALUES as type ALL; that is not a scan
+                if (plan_row.get('select_type') or '').upper() == 'INSERT':
+                    continue
+                if (plan_row.get('type') or '').upper() == 'ALL':
+                    entry['full_scans'].append(plan_row.get('table'))
+        except Exception as e:
+            entry['error'] = str(e)
+        report.append(entry)
+    return report
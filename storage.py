@@ -0,0 +1,180 @@
+# storage.py
+import os
+import uuid
+from flask import current_app, url_for
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+
+class StorageError(Exception):
+    pass
+
+
+# Content types are derived from the (already allowed) extension, never taken from
+# the client, so nothing but images can be served from the storage domain
+IMAGE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+}
+
+
+def content_type_for(key):
+    ext = key.rsplit('.', 1)[-1].lower()
+    if ext not in IMAGE_CONTENT_TYPES:
+        raise StorageError(f"Unsupported image type '{ext}'")
+    return IMAGE_CONTENT_TYPES[ext]
+
+
+def new_image_key(user_id, filename):
+    # Keys are generated server side from a validated id and a random name;
+    # only the extension comes from the client (already checked by allowed_file)
+    if not isinstance(user_id, int) or isinstance(user_id, bool) or user_id <= 0:
+        raise StorageError('user_id must be a positive integer')
+    ext = filename.rsplit('.', 1)[1].lower()
+    return f"users/{user_id}/{uuid.uuid4().hex}.{ext}"
+
+
+class LocalStorage:
+    """Images on the local filesystem under UPLOAD_FOLDER (the original behaviour).
+
+    Signed upload URLs point at the app's own /uploads/<token> endpoint, so in
+    this mode the bytes still pass through a worker; use S3Storage in production.
+    """
+
+    def __init__(self, root, secret_key, max_size):
+        self.root = root
+        self.real_root = os.path.realpath(root)
+        self.max_size = max_size
+        self.serializer = URLSafeTimedSerializer(secret_key, salt='local-upload')
+
+    def path_for(self, key):
+        path = os.path.join(self.root, key)
+        # Refuse anything that resolves outside UPLOAD_FOLDER (e.g. '..' or absolute keys)
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([self.real_root, real_path]) != self.real_root or real_path == self.real_root:
+            raise StorageError('Invalid storage key')
+        return path
+
+    def save(self, key, fileobj):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = 0
+        with open(path, 'wb') as f:
+            while True:
+                chunk = fileobj.read(64 * 1024)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > self.max_size:
+                    f.close()
+                    os.remove(path)
+                    raise StorageError('Upload exceeds the maximum allowed size')
+                f.write(chunk)
+        return written
+
+    def create_upload(self, key, expires_in):
+        # Same shape as S3's presigned POST: send `fields` plus the bytes as form field `file`
+        token = self.serializer.dumps({'key': key})
+        return {
+            'url': url_for('local_upload', token=token, _external=True),
+            'method': 'POST',
+            'fields': {},
+        }
+
+    def load_upload_token(self, token, max_age):
+        try:
+            return self.serializer.loads(token, max_age=max_age)
+        except SignatureExpired:
+            raise StorageError('Upload URL has expired')
+        except BadSignature:
+            raise StorageError('Invalid upload URL')
+
+    def size(self, key):
+        path = self.path_for(key)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    def delete(self, key):
+        path = self.path_for(key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def url(self, key):
+        return self.path_for(key)
+
+
+class S3Storage:
+    """Images in an S3-compatible bucket (AWS S3, or a local stand-in such as MinIO).
+
+    Clients POST straight to a presigned URL, so no image bytes reach the app.
+    """
+
+    def __init__(self, bucket, max_size, endpoint_url=None, region=None, public_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise StorageError("STORAGE_BACKEND 's3' requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.max_size = max_size
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        base = public_url or (endpoint_url and f"{endpoint_url.rstrip('/')}/{bucket}") \
+            or f"https://{bucket}.s3.amazonaws.com"
+        self.public_url = base.rstrip('/')
+
+    def save(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs={'ContentType': content_type_for(key)})
+
+    def create_upload(self, key, expires_in):
+        # A presigned POST policy lets S3 itself reject bodies over max_size,
+        # which a presigned PUT URL cannot do
+        content_type = content_type_for(key)
+        post = self.client.generate_presigned_post(
+            self.bucket,
+            key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, self.max_size],
+            ],
+            ExpiresIn=expires_in,
+        )
+        return {'url': post['url'], 'method': 'POST', 'fields': post['fields']}
+
+    def size(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return None
+        return head['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key):
+        return f"{self.public_url}/{key}"
+
+
+def init_storage(app):
+    backend = app.config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'], app.config['SECRET_KEY'], app.config['MAX_CONTENT_LENGTH'])
+    elif backend == 's3':
+        if not app.config.get('S3_BUCKET'):
+            raise StorageError("STORAGE_BACKEND 's3' requires S3_BUCKET")
+        storage = S3Storage(
+            app.config['S3_BUCKET'],
+            app.config['MAX_CONTENT_LENGTH'],
+            endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+            region=app.config.get('S3_REGION'),
+            public_url=app.config.get('S3_PUBLIC_URL'),
+        )
+    else:
+        raise StorageError(f"Unknown STORAGE_BACKEND '{backend}'")
+    app.extensions['storage'] = storage
+    return storage
+
+
+def get_storage():
+    return current_app.extensions['storage']